@@ -3,13 +3,71 @@ An extension for the `python-markdown <https://pypi.org/project/Markdown/>`_ pac
 pages in a nicer way than pure markdown.
 """
 
-import re
-import html
+import functools
+import textwrap
+from html import unescape as _unescape
 from markdown.postprocessors import Postprocessor
 from markdown.preprocessors import Preprocessor
 from markdown.extensions import Extension
 from markdown import Markdown
 
+# Section link prefixes with the extra hashtags of headers h6 down to h2, longest first
+_SECTION_LINK_PREFIXES = tuple('](' + '#' * count for count in range(6, 1, -1))
+_CODE_OPEN = '<pre><code'
+_CODE_CLOSE = '</code></pre>'
+_CODE_LANG_PREFIX = ' class="language-'
+
+# Pieces of the Confluence code macro that wraps each code block
+_MACRO_PREFIX = '<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">'
+_MACRO_MID = '</ac:parameter><ac:plain-text-body><![CDATA['
+_MACRO_SUFFIX = ']]></ac:plain-text-body></ac:structured-macro>'
+
+# Maps certain languages to supported confluence languages
+_LANG_MAP = {'bash': 'shell'}
+
+def _is_language_name(language: str) -> bool:
+    """
+    Checks that a code block language is a plain word, as rendered by the fenced code extension.
+    """
+    # underscores count as word characters, matching the \w+ of the fenced code language class
+    return language.replace('_', 'a').isalnum()
+
+def _fast_unescape(content: str) -> str:
+    """
+    Decodes the HTML entities that markdown emits in code blocks with plain string replacements, falling back to
+    :func:`html.unescape` when any other entity is present.
+    """
+    if '&' not in content:
+        return content
+    decoded = content.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"').replace('&#39;', "'")
+    # any ampersand that is not part of an escaped ampersand belongs to an entity not handled above
+    if decoded.count('&') != decoded.count('&amp;'):
+        return _unescape(content)
+    # escaped ampersands are decoded last so that e.g. &amp;lt; is not decoded twice
+    return decoded.replace('&amp;', '&')
+
+def _strip_indent(block: str, indent: str) -> str:
+    """
+    Removes the given indentation prefix from each line of a block, leaving lines that do not start with it untouched.
+    """
+    if not indent:
+        return block
+    return '\n'.join(line.removeprefix(indent) for line in block.split('\n'))
+
+@functools.lru_cache(maxsize=1024)
+def _build_macro(language: str, code_content: str, dedent: bool) -> str:
+    """
+    Decodes HTML entities in a code block and wraps it in a Confluence code macro. Results are cached since the same
+    snippets are often repeated across a page.
+    """
+    language = _LANG_MAP.get(language, language)
+    # Decode HTML entities in the code content
+    decoded_content = _fast_unescape(code_content)
+    if dedent:
+        # Remove only the whitespace prefix shared by all non-blank lines so tabs and spaces are never mixed up
+        decoded_content = textwrap.dedent(decoded_content)
+    return _MACRO_PREFIX + language + _MACRO_MID + decoded_content + _MACRO_SUFFIX
+
 class SectionLinkPreprocessor(Preprocessor):
     """
     A preprocessor that removes extra hashtags before section links.
@@ -18,11 +76,28 @@ class SectionLinkPreprocessor(Preprocessor):
         """
         Removes extra hashtags before section links such that they have only one hashtag.
         """
-        modified_lines: list[str] = []
-        for line in lines:
-            # replace links to sections on the page with one hashtag instead of multiple to work in confluence urls
-            modified_lines.append(re.sub(r'\]\(#+', r'](#', line, flags=re.DOTALL))
-        return modified_lines
+        text = '\n'.join(lines)
+        # skip documents without section links that have extra hashtags
+        if '](##' not in text:
+            return lines
+        # replace links to sections on the page with one hashtag instead of multiple to work in confluence urls
+        for prefix in _SECTION_LINK_PREFIXES:
+            text = text.replace(prefix, '](#')
+        # collapse any longer runs of hashtags that are left over in a single pass
+        start = text.find('](##')
+        if start >= 0:
+            fragments: list[str] = []
+            position = 0
+            while start >= 0:
+                run_end = start + 4
+                while run_end < len(text) and text[run_end] == '#':
+                    run_end += 1
+                fragments.append(text[position:start + 3])
+                position = run_end
+                start = text.find('](##', run_end)
+            fragments.append(text[position:])
+            text = ''.join(fragments)
+        return text.split('\n')
 
 
 class IndentedCodeBlockPreprocessor(Preprocessor):
@@ -33,91 +108,135 @@ class IndentedCodeBlockPreprocessor(Preprocessor):
         """
         Removes indentation from fenced code blocks so they are properly recognized by markdown parser.
         """
-        modified_lines: list[str] = []
+        text = '\n'.join(lines)
+        # Documents without any fences need no scan at all
+        if '```' not in text:
+            return lines
+        fragments: list[str] = []
+        position = 0
+        search = 0
         in_code_block = False
-        code_block_indent = 0
-        
-        for line in lines:
-            # Check for fenced code block start
-            if not in_code_block and re.match(r'^(\s*)```', line):
-                in_code_block = True
-                # Calculate the indentation of the opening fence
-                code_block_indent = len(line) - len(line.lstrip())
-                # Remove indentation from the opening fence
-                modified_lines.append(line.lstrip())
-            # Check for fenced code block end
-            elif in_code_block and re.match(r'^(\s*)```\s*$', line):
+        code_block_indent = ''
+
+        # Jump from fence to fence through the whole document instead of visiting every line
+        while True:
+            fence = text.find('```', search)
+            if fence < 0:
+                break
+            line_start = text.rfind('\n', 0, fence) + 1
+            line_end = text.find('\n', fence)
+            if line_end < 0:
+                line_end = len(text)
+            search = line_end
+            line = text[line_start:line_end]
+            stripped = line.lstrip()
+            # Only fences at the start of a line open a code block, and only bare fences close it
+            if not stripped.startswith('```') or (in_code_block and stripped.rstrip() != '```'):
+                continue
+            enclosed = text[position:line_start]
+            fragments.append(_strip_indent(enclosed, code_block_indent) if in_code_block else enclosed)
+            # Remove indentation from the fence itself
+            fragments.append(stripped)
+            if in_code_block:
                 in_code_block = False
-                # Remove indentation from the closing fence
-                modified_lines.append(line.lstrip())
-                code_block_indent = 0
-            # Process lines inside code blocks
-            elif in_code_block:
-                # Remove the same amount of indentation as the opening fence
-                if len(line) >= code_block_indent and line[:code_block_indent].isspace():
-                    modified_lines.append(line[code_block_indent:])
-                else:
-                    modified_lines.append(line)
+                code_block_indent = ''
             else:
-                # Regular line outside code blocks
-                modified_lines.append(line)
-        
-        return modified_lines
+                in_code_block = True
+                # Remember the indentation of the opening fence
+                code_block_indent = line[:len(line) - len(stripped)]
+            position = line_end
+
+        remainder = text[position:]
+        fragments.append(_strip_indent(remainder, code_block_indent) if in_code_block else remainder)
+        return ''.join(fragments).split('\n')
 
 class CodeBlockPostprocessor(Postprocessor):
     """
     A postprocessor that reformats HTML code blocks to Confluence code snippet macros.
     """
+    def __init__(self, md: Markdown | None = None, dedent: bool = False):
+        """
+        :param Markdown md: The markdown instance the postprocessor is registered to
+        :param bool dedent: Whether to remove the common leading indentation from code blocks
+        """
+        super().__init__(md)
+        self._dedent = dedent
+
     def run(self, text: str) -> str:
         """
         Replaces HTML code blocks with Confluence code snippet macros with language support.
         """
-        def decode_and_wrap(match):
-            """Helper function to decode HTML entities and wrap in CDATA"""
-            language = match.group(1) if match.lastindex >= 1 else "none"
-            code_content = match.group(2) if match.lastindex >= 2 else match.group(1)
-            # Decode HTML entities in the code content
-            decoded_content = html.unescape(code_content)
-            return f'<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">{language}</ac:parameter><ac:plain-text-body><![CDATA[{decoded_content}]]></ac:plain-text-body></ac:structured-macro>'
-        
-        # First, handle code blocks with language specification
-        processed_text = re.sub(
-            r'<pre><code class="language-(\w+)">(.*?)</code></pre>', 
-            decode_and_wrap,
-            text,
-            flags=re.DOTALL
-        )
-        
-        # Then handle code blocks without language specification
-        processed_text = re.sub(
-            r'<pre><code>(.*?)</code></pre>', 
-            decode_and_wrap,
-            processed_text,
-            flags=re.DOTALL
-        )
-        
-        # Map certain languages to supported confluence languages
-        if processed_text != text:
-            processed_text = re.sub(
-                r'<ac:parameter ac:name="language">bash</ac:parameter>', 
-                r'<ac:parameter ac:name="language">shell</ac:parameter>', 
-                processed_text,
-                flags=re.DOTALL
-            )
-        return processed_text
+        if _CODE_OPEN not in text:
+            return text
+        # Scan for code blocks by index rather than with a lazy DOTALL regex so large blocks are never backtracked over
+        fragments: list[str] = []
+        position = 0
+        while True:
+            start = text.find(_CODE_OPEN, position)
+            if start < 0:
+                break
+            tag_end = text.find('>', start + len(_CODE_OPEN))
+            if tag_end < 0:
+                break
+            attributes = text[start + len(_CODE_OPEN):tag_end]
+            if not attributes:
+                language = "none"
+            elif attributes.startswith(_CODE_LANG_PREFIX) and attributes.endswith('"'):
+                language = attributes[len(_CODE_LANG_PREFIX):-1]
+            else:
+                language = ""
+            if not _is_language_name(language):
+                # Leave code blocks with unrecognized attributes untouched
+                fragments.append(text[position:tag_end + 1])
+                position = tag_end + 1
+                continue
+            # Only search for the closing tag once the block is known to be convertible, so skipped openers never
+            # scan ahead and the whole pass stays linear
+            end = text.find(_CODE_CLOSE, tag_end + 1)
+            if end < 0:
+                break
+            fragments.append(text[position:start])
+            fragments.append(self.decode_and_wrap(language, text[tag_end + 1:end]))
+            position = end + len(_CODE_CLOSE)
+        if not fragments:
+            return text
+        fragments.append(text[position:])
+        return ''.join(fragments)
+
+    def decode_and_wrap(self, language: str, code_content: str) -> str:
+        """
+        Decodes HTML entities in a code block and wraps it in a Confluence code macro.
+        """
+        return _build_macro(language, code_content, self._dedent)
+
+# The processors hold no per-document state, so a single instance of each is shared by every Markdown instance
+_SECTION_LINK_PRE = SectionLinkPreprocessor()
+_INDENT_CODE_PRE = IndentedCodeBlockPreprocessor()
+_CODE_POST = CodeBlockPostprocessor()
+_DEDENT_CODE_POST = CodeBlockPostprocessor(dedent=True)
 
 class ConfluenceExtension(Extension):
     """
     The extension to be included in the `extensions` argument of the :ref:`Markdown.markdown` function.
     """
+    def __init__(self, **kwargs):
+        """
+        Sets up the configuration options of the extension.
+        """
+        self.config = {
+            'dedent_code_blocks': [False, 'Remove the common leading indentation from code blocks - Default: False'],
+        }
+        super().__init__(**kwargs)
+
     def extendMarkdown(self, md: Markdown):
         """
         Adds the processors to the extension.
         """
         md.registerExtension(self)
-        md.preprocessors.register(IndentedCodeBlockPreprocessor(md), 'confluence_indented_code_blocks', 10)
-        md.preprocessors.register(SectionLinkPreprocessor(md), 'confluence_section_links', 0)
-        md.postprocessors.register(CodeBlockPostprocessor(md), 'confluence_code_block', 0)
+        md.preprocessors.register(_INDENT_CODE_PRE, 'confluence_indented_code_blocks', 10)
+        md.preprocessors.register(_SECTION_LINK_PRE, 'confluence_section_links', 0)
+        code_postprocessor = _DEDENT_CODE_POST if self.getConfig('dedent_code_blocks') else _CODE_POST
+        md.postprocessors.register(code_postprocessor, 'confluence_code_block', 0)
 
 def makeExtension(*args, **kwargs):
     """
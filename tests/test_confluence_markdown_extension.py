@@ -1,4 +1,5 @@
 import unittest
+import markdown
 from src.confluence_markdown_extension import *
 from unittest.mock import patch
 
@@ -16,6 +17,22 @@ class TestSectionLinkPreprocessor(unittest.TestCase):
             "- [Header](#header1)"
         ])
 
+    def test_run_with_long_hashtag_runs(self):
+        lines: list[str] = [
+            "[Deep](######header6) and [deeper](##########header)",
+            "No links here"
+        ]
+        processed_lines = SectionLinkPreprocessor().run(lines)
+        self.assertEqual(processed_lines, [
+            "[Deep](#header6) and [deeper](#header)",
+            "No links here"
+        ])
+
+    def test_run_with_very_long_hashtag_run(self):
+        lines: list[str] = ["text"] * 1000 + ["[Link](" + "#" * 50000 + "header) and [other](#######other)"]
+        processed_lines = SectionLinkPreprocessor().run(lines)
+        self.assertEqual(processed_lines, ["text"] * 1000 + ["[Link](#header) and [other](#other)"])
+
 class TestIndentedCodeBlockPreprocessor(unittest.TestCase):
     def setUp(self):
         self.preprocessor = IndentedCodeBlockPreprocessor()
@@ -65,6 +82,22 @@ class TestIndentedCodeBlockPreprocessor(unittest.TestCase):
             "```"
         ]
         self.assertEqual(processed_lines, expected)
+    
+    def test_run_with_mismatched_indentation(self):
+        lines = [
+            "  ```bash",
+            "  echo one",
+            "\techo two",
+            "  ```"
+        ]
+        processed_lines = self.preprocessor.run(lines)
+        expected = [
+            "```bash",
+            "echo one",
+            "\techo two",
+            "```"
+        ]
+        self.assertEqual(processed_lines, expected)
 
 class TestCodeBlockPostprocessor(unittest.TestCase):
     def setUp(self):
@@ -79,6 +112,11 @@ class TestCodeBlockPostprocessor(unittest.TestCase):
         processed_text = self.postprocessor.run(text)
         self.assertEqual(processed_text, "<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">json</ac:parameter><ac:plain-text-body><![CDATA[{\"name\": \"value\"}]]></ac:plain-text-body></ac:structured-macro>")
     
+    def test_run_with_escaped_entities(self):
+        text = "<pre><code>&amp;lt;b&amp;gt; &amp;&amp; &lt;i&gt; &#39;&copy;&#x27;</code></pre>"
+        processed_text = self.postprocessor.run(text)
+        self.assertEqual(processed_text, "<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">none</ac:parameter><ac:plain-text-body><![CDATA[&lt;b&gt; && <i> '\u00a9']]></ac:plain-text-body></ac:structured-macro>")
+    
     def test_run_without_language(self):
         text = "<pre><code>echo 'hello world'</code></pre>"
         processed_text = self.postprocessor.run(text)
@@ -93,6 +131,38 @@ class TestCodeBlockPostprocessor(unittest.TestCase):
         text = "<pre><code class=\"language-python\">    def hello():\n        print(&quot;world&quot;)\n    \n    hello()</code></pre>"
         processed_text = self.postprocessor.run(text)
         self.assertEqual(processed_text, "<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">python</ac:parameter><ac:plain-text-body><![CDATA[    def hello():\n        print(\"world\")\n    \n    hello()]]></ac:plain-text-body></ac:structured-macro>")
+    
+    def test_run_with_multiple_code_blocks(self):
+        text = "<p>Install:</p>\n<pre><code class=\"language-bash\">pip install markdown</code></pre>\n<pre><code>a &lt; b</code></pre>"
+        processed_text = self.postprocessor.run(text)
+        self.assertEqual(processed_text, "<p>Install:</p>\n<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">shell</ac:parameter><ac:plain-text-body><![CDATA[pip install markdown]]></ac:plain-text-body></ac:structured-macro>\n<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">none</ac:parameter><ac:plain-text-body><![CDATA[a < b]]></ac:plain-text-body></ac:structured-macro>")
+    
+    def test_run_with_unrecognized_language(self):
+        text = "<pre><code class=\"language-c++\">int main();</code></pre>"
+        processed_text = self.postprocessor.run(text)
+        self.assertEqual(processed_text, text)
+    
+    def test_run_with_underscore_language(self):
+        text = "<pre><code class=\"language-_\">x</code></pre><pre><code class=\"language-my_lang2\">y</code></pre>"
+        processed_text = self.postprocessor.run(text)
+        self.assertEqual(processed_text, "<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">_</ac:parameter><ac:plain-text-body><![CDATA[x]]></ac:plain-text-body></ac:structured-macro><ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">my_lang2</ac:parameter><ac:plain-text-body><![CDATA[y]]></ac:plain-text-body></ac:structured-macro>")
+    
+    def test_run_with_many_unrecognized_languages(self):
+        text = "<pre><code class=\"language-c++\">x\n" * 40000 + "</code></pre>"
+        processed_text = self.postprocessor.run(text)
+        self.assertEqual(processed_text, text)
+    
+    def test_run_with_dedent(self):
+        postprocessor = CodeBlockPostprocessor(dedent=True)
+        text = "<pre><code class=\"language-python\">    def hello():\n        print(&quot;world&quot;)\n\n    hello()</code></pre>"
+        processed_text = postprocessor.run(text)
+        self.assertEqual(processed_text, "<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">python</ac:parameter><ac:plain-text-body><![CDATA[def hello():\n    print(\"world\")\n\nhello()]]></ac:plain-text-body></ac:structured-macro>")
+    
+    def test_run_with_dedent_mixed_indentation(self):
+        postprocessor = CodeBlockPostprocessor(dedent=True)
+        text = "<pre><code>\tif x:\n        y()</code></pre>\n<pre><code>\t  if x:\n\t      y()</code></pre>"
+        processed_text = postprocessor.run(text)
+        self.assertEqual(processed_text, "<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">none</ac:parameter><ac:plain-text-body><![CDATA[\tif x:\n        y()]]></ac:plain-text-body></ac:structured-macro>\n<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">none</ac:parameter><ac:plain-text-body><![CDATA[if x:\n    y()]]></ac:plain-text-body></ac:structured-macro>")
 
 class TestConfluenceExtension(unittest.TestCase):
     def test_extend_markdown(self):
@@ -104,6 +174,18 @@ class TestConfluenceExtension(unittest.TestCase):
         self.assertTrue('confluence_section_links' in md.preprocessors, "Section links preprocessor is registered")
         self.assertTrue('confluence_code_block' in md.postprocessors, "Code block postprocessor is registered")
 
+    def test_extend_markdown_reuses_processors(self):
+        md, other_md = Markdown(), Markdown()
+        ConfluenceExtension().extendMarkdown(md)
+        ConfluenceExtension().extendMarkdown(other_md)
+        self.assertIs(md.preprocessors['confluence_section_links'], other_md.preprocessors['confluence_section_links'])
+        self.assertIs(md.postprocessors['confluence_code_block'], other_md.postprocessors['confluence_code_block'])
+
+    def test_extend_markdown_with_dedent(self):
+        text = "```python\n    x = 1\n        y()\n```"
+        converted_html = markdown.markdown(text, extensions=['fenced_code', ConfluenceExtension(dedent_code_blocks=True)])
+        self.assertEqual(converted_html, "<ac:structured-macro ac:name=\"code\"><ac:parameter ac:name=\"language\">python</ac:parameter><ac:plain-text-body><![CDATA[x = 1\n    y()\n]]></ac:plain-text-body></ac:structured-macro>")
+
 class TestMakeExtension(unittest.TestCase):
     def test_make_extension(self):
         extension = makeExtension()